@@ -8,6 +8,15 @@ from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from routers.timetable import router as timetable_router
+from services.static_assets import (
+    ASSETS_URL,
+    BUILD_STATIC_DIR,
+    APIGZipMiddleware,
+    PrecompressedStaticFiles,
+    render_page,
+    static_url,
+    warn_if_stale_build,
+)
 
 
 # -------------------
@@ -89,22 +98,31 @@ class BusStopListResponse(BaseModel):
 app = FastAPI()
 app.include_router(timetable_router)    # 時刻表ルーター
 
+# API の JSON などテキスト系のレスポンスをgzip圧縮（画像・圧縮済みのレスポンスはそのまま通す）
+app.add_middleware(APIGZipMiddleware, minimum_size=1000, compresslevel=6)
+
 # staticフォルダを公開
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# build_static.py でビルドしたハッシュ付きアセットを長期キャッシュ付きで公開
+# （起動後にビルドしても配信できるよう、dist/ が無くてもマウントしておく）
+app.mount(ASSETS_URL, PrecompressedStaticFiles(directory=BUILD_STATIC_DIR, check_dir=False), name="assets")
+warn_if_stale_build()
+
 # templatesフォルダをテンプレートとして利用
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_url
 
 
 # 動作確認用
 @app.get("/")
 def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return render_page(request, templates, "index.html")
 
 #/map エンドポイント
 @app.get("/map")
 def read_map(request: Request):
-    return templates.TemplateResponse("map.html", {"request": request})
+    return render_page(request, templates, "map.html")
 
 
 # /restaurants エンドポイント
@@ -0,0 +1,135 @@
+import json  # マニフェスト入出力
+import posixpath  # CSS 内の相対 URL 解決
+import re  # CSS 内の url() 書き換え
+
+from jinja2 import Environment, FileSystemLoader  # テンプレートの事前レンダリング
+
+from services.static_assets import (
+    ASSETS_URL,
+    BUILD_DIR,
+    ENCODINGS,
+    STATIC_DIR,
+    STATIC_URL,
+    TEMPLATE_DIR,
+    content_hash,
+    static_url,
+    write_atomic,
+    write_compressed,
+)
+
+# 圧縮して効果があるテキスト系の拡張子（画像は既に圧縮済みなので対象外）
+COMPRESS_SUFFIXES = {'.css', '.js', '.html', '.svg', '.json', '.txt'}
+
+# 事前レンダリングするページ（データを使わないもの）
+PAGES = ['index.html', 'map.html']
+
+CSS_URL_RE = re.compile(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)')
+EXTERNAL_URL_PREFIXES = ('data:', 'http://', 'https://', '//', '#')
+
+
+def hashed_name(rel_path, data):  # css/index.css -> css/index.3f2a9c1d.css
+    parent, _, filename = rel_path.rpartition('/')
+    stem, dot, suffix = filename.rpartition('.')
+    if not dot:
+        stem, suffix = filename, ''
+    name = f'{stem}.{content_hash(data)}' + (f'.{suffix}' if suffix else '')
+    return f'{parent}/{name}' if parent else name
+
+
+def write_asset(static_out, rel_path, data, manifest):  # ハッシュ付きで書き出し、マニフェストに登録
+    hashed = hashed_name(rel_path, data)
+    out = static_out / hashed
+    out.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(out, data)
+    if out.suffix in COMPRESS_SUFFIXES:
+        write_compressed(out, data)
+    manifest[rel_path] = hashed
+
+
+def rewrite_css(css_path, data, manifest):
+    """
+    url(/static/...) と url(../images/...) をハッシュ付き URL に置き換える
+    対応するファイルが無い url() はビルドエラーにする（配信時に 404 になるため）
+    """
+    def replace(m):
+        url = m.group(2).strip()
+        if url.startswith(EXTERNAL_URL_PREFIXES):
+            return m.group(0)
+        path = re.split(r'[?#]', url, maxsplit=1)[0]
+        if path.startswith(STATIC_URL + '/'):
+            rel = path[len(STATIC_URL) + 1:]
+        elif path.startswith('/'):
+            rel = None
+        else:
+            rel = posixpath.normpath(posixpath.join(posixpath.dirname(css_path), path))
+        if rel not in manifest:
+            raise ValueError(f'{css_path}: url({url}) does not match any file under {STATIC_DIR}')
+        return f'url("{ASSETS_URL}/{manifest[rel]}")'
+    return CSS_URL_RE.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def prune_old_assets(static_out, keep):  # 今回と前回のビルド以外のハッシュ付きファイルを消す
+    suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    for path in static_out.rglob('*'):
+        if not path.is_file():
+            continue
+        rel = path.relative_to(static_out).as_posix()
+        if rel.endswith(suffixes):
+            rel = rel.rsplit('.', 1)[0]
+        if rel not in keep:
+            path.unlink()
+
+
+def build(static_dir=STATIC_DIR, template_dir=TEMPLATE_DIR, build_dir=BUILD_DIR):
+    """
+    配信中のサーバーを止めずに再ビルドできるよう、次の順で公開する
+    1. ハッシュ付きアセット（名前が新しいので既存ファイルとぶつからない）
+    2. 事前レンダリング済みページ
+    3. マニフェスト（サーバーはこれの置き換えを見てキャッシュを捨てる）
+    前回ビルドのアセットは、古い HTML を持っているクライアントのために残しておく
+    """
+    static_out = build_dir / 'static'
+    pages_out = build_dir / 'pages'
+    manifest_file = build_dir / 'manifest.json'
+    static_out.mkdir(parents=True, exist_ok=True)
+    pages_out.mkdir(parents=True, exist_ok=True)
+
+    previous = {}
+    if manifest_file.exists():
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+
+    manifest = {}
+    files = sorted(p for p in static_dir.rglob('*') if p.is_file())
+
+    # ===== CSS 以外（画像・JS）=====
+    # CSS が参照する画像のハッシュを先に確定させる
+    for path in files:
+        if path.suffix != '.css':
+            write_asset(static_out, path.relative_to(static_dir).as_posix(), path.read_bytes(), manifest)
+
+    # ===== CSS =====
+    for path in files:
+        if path.suffix == '.css':
+            rel = path.relative_to(static_dir).as_posix()
+            write_asset(static_out, rel, rewrite_css(rel, path.read_bytes(), manifest), manifest)
+
+    # ===== ページ =====
+    env = Environment(loader=FileSystemLoader(str(template_dir)), autoescape=True)
+    env.globals['static_url'] = lambda p: static_url(p, manifest)
+    for name in PAGES:
+        data = env.get_template(name).render().encode('utf-8')
+        out = pages_out / name
+        write_atomic(out, data)
+        write_compressed(out, data)
+
+    # ===== マニフェスト（公開）=====
+    write_atomic(manifest_file, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    prune_old_assets(static_out, set(manifest.values()) | set(previous.values()))
+
+    print(f'{len(manifest)} assets, {len(PAGES)} pages -> {build_dir}')
+
+
+if __name__ == '__main__':
+    build()
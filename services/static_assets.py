@@ -0,0 +1,265 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+from pathlib import Path
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+STATIC_DIR = BASE_DIR / "static"
+TEMPLATE_DIR = BASE_DIR / "templates"
+BUILD_DIR = BASE_DIR / "dist"   # build_static.py の出力先
+BUILD_STATIC_DIR = BUILD_DIR / "static"   # フィンガープリント付き静的ファイル
+BUILD_PAGES_DIR = BUILD_DIR / "pages"   # 事前レンダリング済み HTML
+MANIFEST_FILE = BUILD_DIR / "manifest.json"   # 元パス -> ハッシュ付きパス（ビルドの最後に書かれる）
+
+STATIC_URL = "/static"   # 開発用（ビルド前）の公開パス
+ASSETS_URL = "/assets"   # ビルド済みアセットの公開パス
+
+# ハッシュ付きファイルは中身が変われば URL も変わるので 1 年キャッシュしてよい
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# HTML は URL が固定なので毎回 ETag で再検証させる
+PAGE_CACHE_CONTROL = "no-cache"
+
+# (Accept-Encoding のトークン, ファイルの拡張子) を優先度順に並べたもの
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# 実行時に gzip 圧縮する Content-Type（画像などは圧縮しても小さくならない）
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/")
+
+# マニフェストの (inode, mtime) をキーにしたキャッシュ
+# build_static.py はマニフェストを os.replace で置き換えるので、再ビルドすると必ずキーが変わる
+_build_key = None
+_manifest = {}  # { "css/index.css": "css/index.3f2a9c1d.css", ... }
+_page_cache = {}  # { template_name: {encoding: (body, etag)} }
+
+
+def _current_build_key():
+    try:
+        st = os.stat(MANIFEST_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+def load_manifest() -> dict:
+    """
+    ビルド済みマニフェストを返す
+    マニフェストが置き換わっていたら読み直し、事前レンダリング済みページのキャッシュも捨てる
+    ビルドしていない場合は空 dict を返し、従来どおり /static から配信する
+    """
+    global _build_key, _manifest
+    key = _current_build_key()
+    if key != _build_key:
+        if key is None:
+            _manifest = {}
+        else:
+            with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+                _manifest = json.load(f)
+        _page_cache.clear()
+        _build_key = key
+    return _manifest
+
+
+def static_url(path: str, manifest: dict | None = None) -> str:
+    """
+    テンプレートから呼ぶ静的ファイルの URL 解決関数
+    例: static_url("css/index.css") -> "/assets/css/index.3f2a9c1d.css"
+    """
+    if manifest is None:
+        manifest = load_manifest()
+    hashed = manifest.get(path)
+    if hashed is None:
+        return f"{STATIC_URL}/{path}"
+    return f"{ASSETS_URL}/{hashed}"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:8]
+
+
+def warn_if_stale_build() -> None:
+    """static/ や templates/ がビルドより新しければ、build_static.py の再実行を促す"""
+    if not MANIFEST_FILE.exists():
+        return
+    built_at = MANIFEST_FILE.stat().st_mtime
+    for src_dir in (STATIC_DIR, TEMPLATE_DIR):
+        for path in src_dir.rglob("*"):
+            if path.is_file() and path.stat().st_mtime > built_at:
+                logger.warning(
+                    "%s is newer than %s; run `python build_static.py` to rebuild",
+                    path, MANIFEST_FILE,
+                )
+                return
+
+
+def _accepted_encodings(headers: Headers) -> list:
+    """Accept-Encoding ヘッダから q=0 を除いたエンコーディング名の一覧を返す"""
+    accepted = []
+    for part in headers.get("accept-encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.append(token.strip().lower())
+    return accepted
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    """If-None-Match の弱い比較（W/ は無視して値を比べる、* は常に一致）"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+def _media_type(path: str) -> str:
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if media_type.startswith("text/"):
+        media_type += "; charset=utf-8"  # Starlette の Response と同じく文字コードを明示する
+    return media_type
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    build_static.py が作った .br / .gz をそのまま返す StaticFiles
+    ファイル名にハッシュが入っている前提なので immutable でキャッシュさせる
+    """
+
+    async def check_config(self) -> None:
+        # ビルド前に起動しても、後から build_static.py を実行すれば配信できるようにする
+        if os.path.isdir(self.directory):
+            await super().check_config()
+
+    async def get_response(self, path: str, scope) -> Response:
+        # 圧縮版がある（テキスト系の）ファイルだけ Vary を付ける
+        variants = [
+            (encoding, suffix)
+            for encoding, suffix in ENCODINGS
+            if self.lookup_path(path + suffix)[1] is not None
+        ]
+        accepted = _accepted_encodings(Headers(scope=scope))
+
+        for encoding, suffix in variants:
+            if encoding in accepted:
+                response = await super().get_response(path + suffix, scope)
+                if response.status_code == 200:
+                    response.headers["content-type"] = _media_type(path)
+                    response.headers["content-encoding"] = encoding
+                break
+        else:
+            response = await super().get_response(path, scope)
+
+        if variants:
+            response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+class _TextGZipResponder(GZipResponder):
+    async def send_with_compression(self, message) -> None:
+        if message["type"] == "http.response.start":
+            await super().send_with_compression(message)
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if not content_type.startswith(COMPRESSIBLE_TYPES):
+                self.content_type_is_excluded = True
+            return
+        await super().send_with_compression(message)
+
+
+class APIGZipMiddleware(GZipMiddleware):
+    """
+    API の JSON などテキスト系のレスポンスだけを gzip 圧縮するミドルウェア
+    画像は圧縮しても小さくならないので、そのまま返す
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and "gzip" in _accepted_encodings(Headers(scope=scope)):
+            responder = _TextGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+def _page_response(request, body: bytes, etag: str, encoding: str | None = None) -> Response:
+    headers = {
+        "cache-control": PAGE_CACHE_CONTROL,
+        "etag": etag,
+        "vary": "Accept-Encoding",
+    }
+    if _etag_matches(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["content-encoding"] = encoding
+    return Response(body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+def _load_built_page(name: str) -> dict | None:
+    """事前レンダリング済みページを圧縮版ごと読み込む（ETag は版ごとに別）"""
+    built = BUILD_PAGES_DIR / name
+    if not built.exists():
+        return None
+    variants = {}
+    for encoding, suffix in ((None, ""),) + ENCODINGS:
+        path = BUILD_PAGES_DIR / (name + suffix)
+        if path.exists():
+            body = path.read_bytes()
+            variants[encoding] = (body, f'"{content_hash(body)}"')
+    return variants
+
+
+def render_page(request, templates, name: str) -> Response:
+    """
+    データを使わないページ（/ と /map）を返す
+    1. build_static.py の事前レンダリング結果があれば、圧縮済みの版も含めて返す
+       （ビルドが変わるまでメモリにキャッシュする）
+    2. 無ければ毎回テンプレートをレンダリングする（テンプレートの編集がすぐ反映される）
+    """
+    load_manifest()  # 再ビルドされていればここでキャッシュが捨てられる
+    variants = _page_cache.get(name)
+    if variants is None:
+        variants = _load_built_page(name)
+        if variants is not None:
+            _page_cache[name] = variants
+
+    if variants is None:
+        body = templates.get_template(name).render().encode("utf-8")
+        # GZipMiddleware が圧縮しても同じ値になるので弱い ETag にする
+        return _page_response(request, body, f'W/"{content_hash(body)}"')
+
+    accepted = _accepted_encodings(request.headers)
+    for encoding, _ in ENCODINGS:
+        if encoding in accepted and encoding in variants:
+            body, etag = variants[encoding]
+            return _page_response(request, body, etag, encoding)
+    body, etag = variants[None]
+    return _page_response(request, body, etag)
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """一時ファイルに書いてから置き換える（配信中のサーバーが書きかけを読まないように）"""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def write_compressed(path: Path, data: bytes) -> None:
+    """path.gz（と brotli があれば path.br）を書き出す"""
+    # mtime=0 にしてビルドごとに同じバイト列になるようにする
+    write_atomic(Path(str(path) + ".gz"), gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli  # 任意依存（pip install brotli）
+    except ImportError:
+        return
+    write_atomic(Path(str(path) + ".br"), brotli.compress(data, quality=11))
@@ -0,0 +1,204 @@
+import json
+import os
+import re
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+
+import build_static
+from services import static_assets
+from services.static_assets import (
+    APIGZipMiddleware,
+    PrecompressedStaticFiles,
+    _accepted_encodings,
+    _etag_matches,
+    render_page,
+    static_url,
+)
+
+CSS = 'body { background: url("../images/bg.jpg"); }\n/* 福井駅 */\n' * 20
+JS = 'console.log("福井駅");\n' * 50
+PAGE = '<html><head><link rel="stylesheet" href="{{ static_url(\'css/index.css\') }}"></head><body>{}</body></html>'
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    static_dir = tmp_path / "static"
+    template_dir = tmp_path / "templates"
+    build_dir = tmp_path / "dist"
+    (static_dir / "css").mkdir(parents=True)
+    (static_dir / "images").mkdir()
+    (static_dir / "js").mkdir()
+    template_dir.mkdir()
+    (static_dir / "css" / "index.css").write_text(CSS, encoding="utf-8")
+    (static_dir / "images" / "bg.jpg").write_bytes(b"\xff\xd8" + b"\x00" * 4000)
+    (static_dir / "js" / "main.js").write_text(JS, encoding="utf-8")
+    for name in build_static.PAGES:
+        (template_dir / name).write_text(PAGE.replace("{}", name), encoding="utf-8")
+
+    monkeypatch.setattr(static_assets, "BUILD_PAGES_DIR", build_dir / "pages")
+    monkeypatch.setattr(static_assets, "MANIFEST_FILE", build_dir / "manifest.json")
+    monkeypatch.setattr(static_assets, "_build_key", None)
+    monkeypatch.setattr(static_assets, "_manifest", {})
+    monkeypatch.setattr(static_assets, "_page_cache", {})
+
+    templates = Jinja2Templates(directory=str(template_dir))
+    templates.env.globals["static_url"] = static_url
+
+    app = FastAPI()
+    app.add_middleware(APIGZipMiddleware, minimum_size=100, compresslevel=6)
+    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    app.mount("/assets", PrecompressedStaticFiles(directory=build_dir / "static", check_dir=False), name="assets")
+
+    @app.get("/")
+    def read_root(request: Request):
+        return render_page(request, templates, "index.html")
+
+    @app.get("/data")
+    def data():
+        return {"items": ["福井駅"] * 100}
+
+    def build():
+        build_static.build(static_dir=static_dir, template_dir=template_dir, build_dir=build_dir)
+        with open(build_dir / "manifest.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    site = type("Site", (), {})()
+    site.client = TestClient(app)
+    site.build = build
+    site.static_dir = static_dir
+    site.template_dir = template_dir
+    return site
+
+
+def css_link(html):
+    return re.search(r'href="([^"]+)"', html).group(1)
+
+
+def test_accepted_encodings_skips_q0():
+    headers = Headers({"accept-encoding": "br;q=0, gzip;q=0.5, deflate ; q=0.0, identity"})
+    assert _accepted_encodings(headers) == ["gzip", "identity"]
+
+
+def test_etag_matches():
+    assert _etag_matches('"abc"', '"xyz", "abc"')
+    assert _etag_matches('"abc"', 'W/"abc"')
+    assert _etag_matches('"abc"', "*")
+    assert not _etag_matches('"abc"', '"abcd"')
+    assert not _etag_matches('"abc"', "")
+
+
+def test_assets_variant_selection(site):
+    manifest = site.build()
+    css_url = "/assets/" + manifest["css/index.css"]
+
+    r = site.client.get(css_url, headers={"accept-encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["content-type"] == "text/css; charset=utf-8"
+    assert r.headers["vary"] == "Accept-Encoding"
+    assert r.headers["cache-control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+    assert "../images" not in r.text
+    assert "/assets/" + manifest["images/bg.jpg"] in r.text
+
+    r = site.client.get(css_url, headers={"accept-encoding": "gzip;q=0"})
+    assert "content-encoding" not in r.headers
+    assert r.headers["content-type"] == "text/css; charset=utf-8"
+    assert r.headers["vary"] == "Accept-Encoding"
+
+    r = site.client.get("/assets/" + manifest["images/bg.jpg"], headers={"accept-encoding": "br, gzip"})
+    assert r.status_code == 200
+    assert "content-encoding" not in r.headers
+    assert "vary" not in r.headers
+    assert r.headers["cache-control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+
+
+def test_assets_brotli_variant(site):
+    pytest.importorskip("brotli")
+    manifest = site.build()
+    r = site.client.get("/assets/" + manifest["js/main.js"], headers={"accept-encoding": "gzip, br"})
+    assert r.headers["content-encoding"] == "br"
+    assert r.headers["content-type"].endswith("; charset=utf-8")
+    assert r.text == JS
+
+
+def test_page_variant_selection(site):
+    manifest = site.build()
+    identity = site.client.get("/", headers={"accept-encoding": "identity"})
+    gzipped = site.client.get("/", headers={"accept-encoding": "gzip"})
+
+    assert "content-encoding" not in identity.headers
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert identity.text == gzipped.text
+    assert css_link(identity.text) == "/assets/" + manifest["css/index.css"]
+    # 版ごとに別の ETag
+    assert identity.headers["etag"] != gzipped.headers["etag"]
+
+
+def test_if_none_match_returns_304(site):
+    site.build()
+    etag = site.client.get("/", headers={"accept-encoding": "gzip"}).headers["etag"]
+
+    for value in (etag, f'"other", {etag}', f"W/{etag}", "*"):
+        r = site.client.get("/", headers={"accept-encoding": "gzip", "if-none-match": value})
+        assert r.status_code == 304
+        assert r.content == b""
+
+    r = site.client.get("/", headers={"accept-encoding": "gzip", "if-none-match": etag[:-2] + '"'})
+    assert r.status_code == 200
+
+
+def test_rebuild_while_running(site):
+    site.build()
+    old_link = css_link(site.client.get("/").text)
+
+    (site.static_dir / "css" / "index.css").write_text(CSS + "h1 { color: red; }\n", encoding="utf-8")
+    site.build()
+    new_link = css_link(site.client.get("/").text)
+
+    assert new_link != old_link
+    assert "color: red" in site.client.get(new_link).text
+    # 古い HTML を持っているクライアントのために前回のアセットも残す
+    assert site.client.get(old_link).status_code == 200
+
+
+def test_rebuild_prunes_older_generations(site):
+    site.build()
+    first_link = css_link(site.client.get("/").text)
+    for i in range(2):
+        (site.static_dir / "css" / "index.css").write_text(CSS + f"/* {i} */\n", encoding="utf-8")
+        site.build()
+    assert site.client.get(first_link).status_code == 404
+
+
+def test_css_unmapped_url_fails_build(site):
+    (site.static_dir / "css" / "index.css").write_text('a { background: url("../images/missing.png"); }', encoding="utf-8")
+    with pytest.raises(ValueError, match="missing.png"):
+        site.build()
+
+
+def test_no_build_renders_template_every_time(site):
+    r = site.client.get("/")
+    assert css_link(r.text) == "/static/css/index.css"
+    assert r.headers["etag"].startswith("W/")
+
+    path = site.template_dir / "index.html"
+    path.write_text(PAGE.replace("{}", "edited"), encoding="utf-8")
+    os.utime(path, (path.stat().st_atime + 10, path.stat().st_mtime + 10))
+    assert "edited" in site.client.get("/").text
+
+
+def test_gzip_middleware_only_compresses_text(site):
+    r = site.client.get("/data", headers={"accept-encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+
+    r = site.client.get("/static/images/bg.jpg", headers={"accept-encoding": "gzip"})
+    assert r.status_code == 200
+    assert "content-encoding" not in r.headers
+
+    r = site.client.get("/static/js/main.js", headers={"accept-encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"